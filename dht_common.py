@@ -0,0 +1,117 @@
+"""
+dht_common.py
+
+Pieces shared by manager.py and peer.py:
+  - The JSON codec for UDP datagrams
+  - DrainingProtocol, the asyncio UDP endpoint both processes build on
+  - StdinLines, the selector-driven console reader
+"""
+
+import asyncio
+import os
+import sys
+
+MAX_DATAGRAM_BYTES = 65535  # Largest UDP datagram; a smaller read would truncate
+
+# JSON codec for the UDP path: orjson when installed, otherwise the stdlib.
+# loads accepts bytes and dumps returns bytes, so datagrams skip str round-trips.
+try:
+    import orjson
+    loads = orjson.loads
+    dumps = orjson.dumps
+except ImportError:
+    import json
+    loads = json.loads
+    _ENC = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False).encode
+
+    def dumps(obj):
+        return _ENC(obj).encode()
+
+class DrainingProtocol(asyncio.DatagramProtocol):
+    """
+    asyncio endpoint for a UDP socket. Decodes each datagram and passes it
+    to handle_message(message, addr), draining everything already queued
+    on the socket per wakeup. Errors are printed after error_label.
+    """
+    error_label = "Error in listener:"
+
+    def __init__(self, sock, handle_message):
+        self.sock = sock
+        self.handle_message = handle_message
+
+    def datagram_received(self, data, addr):
+        self._dispatch(data, addr)
+        # The transport hands over one datagram per wakeup; drain the rest of
+        # the queue now so a burst doesn't overflow the receive buffer.
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(MAX_DATAGRAM_BYTES)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self.error_received(e)
+                break
+            self._dispatch(data, addr)
+
+    def _dispatch(self, data, addr):
+        try:
+            self.handle_message(loads(data), addr)
+        except Exception as e:
+            print(self.error_label, e)
+
+    def error_received(self, exc):
+        print(self.error_label, exc)
+
+class StdinLines:
+    """
+    Console input driven by the event loop's selector: stdin is registered
+    with loop.add_reader, so commands are read on the same thread as UDP
+    traffic and no thread sits parked in input(). Where stdin can't be
+    watched (the Windows proactor loop, stdin redirected from a file), this
+    falls back to input() on the default executor.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.lines = asyncio.Queue()      # Complete lines; None marks end of input
+        self.partial = b""                # Bytes read past the last newline
+        self.fd = None
+        try:
+            fd = sys.stdin.fileno()
+            loop.add_reader(fd, self._on_readable)
+            self.fd = fd
+        except (AttributeError, ValueError, OSError, NotImplementedError):
+            pass
+
+    def _on_readable(self):
+        # Read the raw fd rather than sys.stdin: a buffered readline() could
+        # swallow several lines while the selector only reports one wakeup.
+        try:
+            chunk = os.read(self.fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        if not chunk:
+            if self.partial:
+                self.lines.put_nowait(self.partial.decode(errors="replace"))
+            self.lines.put_nowait(None)
+            self.close()
+            return
+        *complete, self.partial = (self.partial + chunk).split(b"\n")
+        for line in complete:
+            self.lines.put_nowait(line.decode(errors="replace"))
+
+    async def readline(self, prompt):
+        """Show prompt and return the next line; raise EOFError once stdin closes."""
+        if self.fd is None and self.lines.empty():
+            return await self.loop.run_in_executor(None, input, prompt)
+        print(prompt, end="", flush=True)
+        line = await self.lines.get()
+        if line is None:
+            self.lines.put_nowait(None)  # Stay at EOF for any later call
+            raise EOFError
+        return line
+
+    def close(self):
+        """Stop watching stdin."""
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
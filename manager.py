@@ -10,69 +10,328 @@ It:
   - Loads and distributes CSV event data to peers
   - Handles peer leave events
   - Supports teardown for graceful shutdown
+
+All networking and console handling runs on a single asyncio event loop.
 """
 
+import asyncio
 import socket
-import threading
-import json
 import csv
 import sys
 import os
+import bisect
+import hashlib
+import errno
+import mmap
+import concurrent.futures
+import collections
+
+from dht_common import DrainingProtocol, StdinLines, dumps
 
 # Configuration
 MANAGER_HOST = '127.0.0.1'
 MANAGER_PORT = 5000
+VERBOSE = False  # Print a line for every store_ack instead of a per-distribution summary
 CSV_FILE = "StormEvents_locations-ftp_v1.0_d2024_c20250317.csv"
+VNODES_PER_PEER = 64  # Points each peer owns on the consistent-hash ring
+RECV_BUFFER_BYTES = 4 << 20  # Kernel receive buffer, sized to absorb store_ack bursts
+PEER_SEND_BUFFER_BYTES = 1 << 20  # Kernel send buffer of each per-peer store socket
+DISTRIBUTE_BATCH = 256  # Events sent between yields to the event loop
+STORE_BATCH = 64  # Store datagrams queued per peer before they are sent together
+DISTRIBUTE_WORKERS = os.cpu_count() or 1  # Upper bound on distribute processes
+
+# Fixed parts of the outgoing message envelopes; only the variable fields are
+# serialized per message and spliced in between.
+_STORE_PREFIX = b'{"command":"store","event_id":'
+_STORE_MID = b',"event_data":'
+_NEXT_PEER_PREFIX = b'{"command":"set_next_peer","next_peer":'
+_ENVELOPE_SUFFIX = b'}'
+_TEARDOWN_PACKET = b'{"command":"teardown"}'
+
+# Send errors on a connected store socket meaning the peer can't be reached:
+# ICMP port-unreachable comes back as ECONNREFUSED, and EBADF means the socket
+# was closed under us. Either way, the rest of that peer's stores are skipped.
+_UNREACHABLE_ERRNOS = (errno.ECONNREFUSED, errno.EBADF)
+
+_HKEY = b"storm-tracker-v1"  # Fixed blake2b key; changing it reshuffles every placement
+
+def _hash64(s):
+    """
+    Keyed 64-bit blake2b hash of a string. Unlike the built-in hash(), the
+    result does not depend on PYTHONHASHSEED, so event placement is the same
+    across manager restarts.
+    """
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8, key=_HKEY).digest(), 'little')
+
+# One immutable view of the peer set: peer_id -> (address, port), the peer IDs
+# in sorted order, and parallel tuples of their addresses and connected store
+# sockets. Membership changes publish a new instance with a single attribute
+# assignment, so a reader that takes self._membership once sees fields that agree.
+_Membership = collections.namedtuple("_Membership", "peers sorted_ids targets peer_socks")
+_NO_PEERS = _Membership({}, (), (), ())
+
+def _build_ring(sorted_ids):
+    """
+    Build a consistent-hash ring for the given peer IDs.
+    Returns (tokens, owners): sorted token positions on the ring and, for each
+    token, the index of its peer in sorted_ids (and the parallel targets).
+    """
+    points = sorted(
+        (_hash64(f"{peer_id}#{v}"), index)
+        for index, peer_id in enumerate(sorted_ids)
+        for v in range(VNODES_PER_PEER)
+    )
+    return [token for token, _ in points], [index for _, index in points]
+
+def _assign_peer(key_hash, tokens, owners):
+    """Return the index of the peer owning a key hash: the first ring token at or after it."""
+    index = bisect.bisect_left(tokens, key_hash)
+    if index == len(tokens):
+        index = 0  # Wrap around the ring
+    return owners[index]
+
+def _send_batch(sock, packets):
+    """
+    Send packets on a connected UDP socket and return how many were sent.
+    A non-blocking socket (the event loop's) stops early once its send
+    buffer fills up, and the caller sends the rest; a blocking socket (a
+    shard worker's) waits for buffer space and sends them all.
+    """
+    for sent, packet in enumerate(packets):
+        try:
+            sock.send(packet)
+        except BlockingIOError:
+            return sent
+    return len(packets)
+
+def _store_packets(rows, header, tokens, owners):
+    """
+    Turn parsed CSV rows into (owner_index, packet) pairs: place each row on
+    the hash ring by its EVENT_ID and build its store message.
+    """
+    # Rows stay plain lists; the EVENT_ID column is found once from the header
+    event_id_index = header.index("EVENT_ID") if "EVENT_ID" in header else None
+    for row in rows:
+        if not row:
+            continue  # Blank line
+        # Use 'EVENT_ID' from the CSV if present; otherwise fall back to
+        # hashing the entire row, whose hash then serves as both the
+        # event_id and the ring position. Either way, one hash per row.
+        if event_id_index is not None and event_id_index < len(row):
+            key_str = row[event_id_index]
+            key_hash = _hash64(key_str)
+        else:
+            key_hash = _hash64(repr(row))
+            key_str = str(key_hash)
+        assigned_index = _assign_peer(key_hash, tokens, owners)
+
+        # Only the per-row parts are serialized; the envelope is constant bytes.
+        # event_data stays a column -> value object on the wire.
+        packet = (
+            _STORE_PREFIX + dumps(key_str)
+            + _STORE_MID + dumps(dict(zip(header, row))) + _ENVELOPE_SUFFIX
+        )
+        yield assigned_index, packet
+
+def _read_header(path):
+    """Return the CSV's header row as a list of column names."""
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        return next(csv.reader(csvfile), [])
+
+def _count_quotes(mm, start, end, chunk=1 << 20):
+    """Count the '"' bytes in mm[start:end], a chunk at a time."""
+    count = 0
+    for offset in range(start, end, chunk):
+        count += mm[offset:min(offset + chunk, end)].count(b'"')
+    return count
+
+def _row_end(mm, row_start, search_from, size):
+    """
+    Return the offset just past the first newline at or after search_from
+    that ends a CSV row: one preceded by an even number of quote characters
+    since row_start. A newline inside a quoted field follows an odd number
+    (escaped quotes come in pairs), so it is skipped. Returns size if no
+    newline ends the row.
+    """
+    quotes = _count_quotes(mm, row_start, search_from)
+    position = search_from
+    while True:
+        newline = mm.find(b'\n', position)
+        if newline < 0:
+            return size
+        quotes += _count_quotes(mm, position, newline)
+        if quotes % 2 == 0:
+            return newline + 1
+        position = newline + 1
+
+def _shard_bounds(path, shards):
+    """
+    Split the CSV's data (everything after the header row) into up to
+    `shards` (start, end) byte ranges, each ending on a row boundary. A
+    newline inside a quoted field never splits a shard (see _row_end).
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = _row_end(mm, 0, 0, size)
+            step = max((size - start) // shards, 1)
+            bounds = []
+            while start < size:
+                end = _row_end(mm, start, min(start + step, size) - 1, size)
+                bounds.append((start, end))
+                start = end
+    return bounds
+
+def _iter_lines(path, start, end):
+    """Yield the decoded lines that begin within [start, end) of the file."""
+    with open(path, 'rb', buffering=1 << 20) as f:
+        f.seek(start)
+        position = start
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode('utf-8')
+
+def _report_unreachable(peer_id, reason):
+    """Print the one message a distribute gives for a peer it stops sending to."""
+    print(f"[Manager] Peer {peer_id} unreachable ({reason}); skipping its remaining events.")
+
+def _shard_worker(path, start, end, header, tokens, owners, peer_ids, targets):
+    """
+    Runs in a pool process: parse, place and send the rows in one byte range
+    of the CSV over this process's own connected sockets, STORE_BATCH packets
+    at a time. The sockets are blocking, so a full send buffer waits
+    instead of dropping. Returns (events read, events actually sent,
+    {peer_id: reason} for peers found unreachable), leaving the reporting to
+    the parent so each peer is reported once rather than once per shard.
+    """
+    peer_socks = []
+    for address in targets:
+        peer_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, PEER_SEND_BUFFER_BYTES)
+        peer_sock.connect(tuple(address))
+        peer_socks.append(peer_sock)
+    pending = [[] for _ in targets]
+    unreachable = {}  # peer_id -> reason; their remaining stores are skipped
+    count = 0
+    sent = 0
+    try:
+        rows = csv.reader(_iter_lines(path, start, end))
+        for count, (assigned_index, packet) in enumerate(_store_packets(rows, header, tokens, owners), 1):
+            queue = pending[assigned_index]
+            queue.append(packet)
+            if len(queue) >= STORE_BATCH:
+                sent += _flush_shard_stores(peer_ids[assigned_index], peer_socks[assigned_index], queue, unreachable)
+        for peer_id, peer_sock, queue in zip(peer_ids, peer_socks, pending):
+            if queue:
+                sent += _flush_shard_stores(peer_id, peer_sock, queue, unreachable)
+    finally:
+        for peer_sock in peer_socks:
+            peer_sock.close()
+    return count, sent, unreachable
+
+def _flush_shard_stores(peer_id, peer_sock, packets, unreachable):
+    """
+    Send and clear a peer's queued store packets on a blocking socket, and
+    return how many actually went out. Packets for a peer in `unreachable`
+    are dropped (see _UNREACHABLE_ERRNOS).
+    """
+    sent = 0
+    if peer_id not in unreachable:
+        try:
+            sent = _send_batch(peer_sock, packets)
+        except OSError as e:
+            if e.errno in _UNREACHABLE_ERRNOS:
+                unreachable[peer_id] = e.strerror
+            else:
+                print(f"[Manager] Error sending stores to peer {peer_id}:", e)
+    packets.clear()
+    return sent
+
+class ManagerProtocol(DrainingProtocol):
+    """asyncio endpoint for the manager's UDP socket; see DrainingProtocol."""
+    error_label = "Error in manager run loop:"
+
+    def __init__(self, manager):
+        super().__init__(manager.sock, manager.handle_message)
 
 class Manager:
     """
     The Manager class:
-      - Maintains a mapping of peer_id -> (peer_address, peer_port)
+      - Maintains a copy-on-write mapping of peer_id -> (peer_address, peer_port)
       - Provides console commands to set up the ring, distribute data, and teardown
       - Loads events from a CSV file
-      - Distributes events using a hash-based assignment
+      - Distributes events using consistent hashing, so a peer joining or
+        leaving only moves the keys it owns
     """
-    def __init__(self, host=MANAGER_HOST, port=MANAGER_PORT):
+    def __init__(self, host=MANAGER_HOST, port=MANAGER_PORT, verbose=VERBOSE):
         self.host = host
         self.port = port
-        # Mapping: peer_id -> (peer_address, peer_port)
-        self.peers = {}
+        self.verbose = verbose
+        # store_acks received since the last distribute, and the number of
+        # stores it actually sent (None while it is still running)
+        self.acks_received = 0
+        self.acks_expected = None
+        # Copy-on-write snapshot of the peer set (see _Membership). Readers never
+        # lock: a distribute_events suspended mid-stream keeps the view it took.
+        # Only the event loop thread publishes, so writers need no lock either.
+        self._membership = _NO_PEERS
+        # Store sockets of peers that left while a distribute still held a
+        # snapshot using them; closed once no distribute is running.
+        self._retired_socks = []
+        self._distributing = 0  # distribute_events calls in progress
         self.next_peer_id = 0
         self.running = True
-        self.events = []  # Will store event rows from CSV
-        self.lock = threading.Lock()
+        self.csv_path = CSV_FILE  # Parsed row by row while distributing; never held in memory
+        self._ring = None  # (membership, ring) cache, valid while membership is current
+        self.transport = None  # Set once run() attaches the socket to the event loop
+        self.protocol = None
+        self._stopped = None  # Future resolved by teardown()
 
         # Create and bind the UDP socket
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
         self.sock.bind((self.host, self.port))
         print(f"Manager started on {self.host}:{self.port}")
 
     def load_csv(self):
-        """Load CSV data into self.events if the file exists."""
-        if not os.path.exists(CSV_FILE):
-            print(f"CSV file {CSV_FILE} not found.")
+        """
+        Check that the CSV file exists and report how many events it holds.
+        Only lines are counted; rows are parsed by distribute_events as it sends them.
+        """
+        if not os.path.exists(self.csv_path):
+            print(f"CSV file {self.csv_path} not found.")
             return
         try:
-            with open(CSV_FILE, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    self.events.append(row)
-            print(f"Loaded {len(self.events)} events from {CSV_FILE}.")
+            with open(self.csv_path, 'rb', buffering=1 << 20) as csvfile:
+                count = sum(1 for _ in csvfile) - 1  # Minus the header line
+            print(f"Found {max(count, 0)} events in {self.csv_path}.")
         except Exception as e:
             print("Error loading CSV:", e)
 
     def run(self):
-        """Main loop to receive and handle incoming UDP messages. Also starts a console thread."""
-        # Start a separate thread to handle console commands
-        threading.Thread(target=self.console_thread, daemon=True).start()
+        """Run the asyncio event loop that handles UDP messages and console commands until teardown."""
+        asyncio.run(self._serve())
 
-        while self.running:
-            try:
-                data, addr = self.sock.recvfrom(4096)
-                message = json.loads(data.decode())
-                self.handle_message(message, addr)
-            except Exception as e:
-                print("Error in manager run loop:", e)
+    async def _serve(self):
+        """Attach the UDP socket to the event loop, start the console, and wait for teardown."""
+        loop = asyncio.get_running_loop()
+        self._stopped = loop.create_future()
+        self.transport, self.protocol = await loop.create_datagram_endpoint(
+            lambda: ManagerProtocol(self), sock=self.sock)
+        console = asyncio.create_task(self.console())
+        try:
+            await self._stopped
+        except asyncio.CancelledError:
+            # Interrupted (e.g. Ctrl-C): notify peers while the transport is still open
+            self.teardown()
+            raise
+        finally:
+            console.cancel()
+            self.transport.close()
 
     def handle_message(self, message, addr):
         """Handle incoming messages from peers."""
@@ -81,9 +340,13 @@ class Manager:
             self.register_peer(message, addr)
         elif command == "store_ack":
             # A peer acknowledges it stored an event
-            peer_id = message.get("peer_id")
-            event_id = message.get("event_id")
-            print(f"[Manager] Received store_ack from peer {peer_id} for event {event_id}")
+            self.acks_received += 1
+            if self.verbose:
+                peer_id = message.get("peer_id")
+                event_id = message.get("event_id")
+                print(f"[Manager] Received store_ack from peer {peer_id} for event {event_id}")
+            if self.acks_received == self.acks_expected:
+                print(f"[Manager] All {self.acks_expected} events acknowledged.")
         elif command == "leave":
             self.remove_peer(message, addr)
         else:
@@ -91,134 +354,275 @@ class Manager:
 
     def register_peer(self, message, addr):
         """
-        Assign a new peer_id, store the peer's (address, port) in self.peers,
-        and reply with 'set_id'.
+        Assign a new peer_id, publish a membership snapshot that includes the
+        peer's (address, port) and store socket, and reply with 'set_id'.
         """
         peer_port = message.get("peer_port")
         peer_address = addr[0]
-        with self.lock:
-            peer_id = self.next_peer_id
-            self.next_peer_id += 1
-            self.peers[peer_id] = (peer_address, peer_port)
+        peer_id = self.next_peer_id
+        self.next_peer_id += 1
+        target = (peer_address, peer_port)
+        m = self._membership
+        index = bisect.bisect_left(m.sorted_ids, peer_id)
+        peers = dict(m.peers)
+        peers[peer_id] = target
+        self._membership = _Membership(
+            peers,
+            m.sorted_ids[:index] + (peer_id,) + m.sorted_ids[index:],
+            m.targets[:index] + (target,) + m.targets[index:],
+            m.peer_socks[:index] + (self._connect_peer_socket(target),) + m.peer_socks[index:],
+        )
 
         print(f"[Manager] Registered peer {peer_id} at {peer_address}:{peer_port}")
         response = {"command": "set_id", "peer_id": peer_id}
-        self.sock.sendto(json.dumps(response).encode(), addr)
+        self.transport.sendto(dumps(response), addr)
 
     def remove_peer(self, message, addr):
         """
-        A peer notifies the manager it is leaving. Remove it from self.peers
-        and update the ring.
+        A peer notifies the manager it is leaving. Publish a membership
+        snapshot without it and update the ring.
         """
         peer_id = message.get("peer_id")
-        with self.lock:
-            if peer_id in self.peers:
-                del self.peers[peer_id]
-                print(f"[Manager] Peer {peer_id} removed. Updating ring...")
-                self.update_ring()
-            else:
-                print(f"[Manager] Attempt to remove unknown peer {peer_id}")
+        m = self._membership
+        if peer_id in m.peers:
+            index = bisect.bisect_left(m.sorted_ids, peer_id)
+            peers = dict(m.peers)
+            del peers[peer_id]
+            self._membership = _Membership(
+                peers,
+                m.sorted_ids[:index] + m.sorted_ids[index + 1:],
+                m.targets[:index] + m.targets[index + 1:],
+                m.peer_socks[:index] + m.peer_socks[index + 1:],
+            )
+            self._retire_socket(m.peer_socks[index])
+            print(f"[Manager] Peer {peer_id} removed. Updating ring...")
+            self.update_ring()
+        else:
+            print(f"[Manager] Attempt to remove unknown peer {peer_id}")
+
+    def _connect_peer_socket(self, address):
+        """
+        Open a non-blocking UDP socket connected to one peer. The kernel
+        resolves the route once, and stores can use send() without passing
+        an address per datagram.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, PEER_SEND_BUFFER_BYTES)
+        sock.setblocking(False)
+        sock.connect(address)
+        return sock
+
+    def _retire_socket(self, sock):
+        """Close a departed peer's store socket, or defer that while a distribute may still use it."""
+        if self._distributing:
+            self._retired_socks.append(sock)
+        else:
+            sock.close()
 
     def update_ring(self):
         """
-        Recompute the ring by sorting peers by ID and sending each peer
-        a 'set_next_peer' message to point to the next peer in the ring.
+        Walk the peers in ID order and send each peer a 'set_next_peer'
+        message to point to the next peer in the ring.
         """
-        with self.lock:
-            sorted_peers = sorted(self.peers.items(), key=lambda x: x[0])
-        n = len(sorted_peers)
+        m = self._membership
+        sorted_ids, targets = m.sorted_ids, m.targets
+        n = len(sorted_ids)
         if n == 0:
             print("[Manager] No peers to update in ring.")
             return
 
-        for i, (peer_id, (address, port)) in enumerate(sorted_peers):
-            next_index = (i + 1) % n
-            next_peer = sorted_peers[next_index][1]  # (address, port)
-            msg = {"command": "set_next_peer", "next_peer": list(next_peer)}
+        for i, (peer_id, (address, port)) in enumerate(zip(sorted_ids, targets)):
+            next_peer = targets[(i + 1) % n]  # (address, port)
+            packet = _NEXT_PEER_PREFIX + dumps(next_peer) + _ENVELOPE_SUFFIX
             try:
-                self.sock.sendto(json.dumps(msg).encode(), (address, port))
+                self.transport.sendto(packet, (address, port))
                 print(f"[Manager] For peer {peer_id}, set next peer to {next_peer}")
             except Exception as e:
                 print(f"[Manager] Error sending set_next_peer to peer {peer_id}:", e)
 
-    def distribute_events(self):
+    async def distribute_events(self):
         """
-        Distribute loaded CSV events to peers by hashing the event's ID
-        to decide which peer gets each event.
+        Stream CSV events to peers by hashing the event's ID
+        to decide which peer gets each event. With more than one peer (and
+        CPU), the CSV is split into byte ranges handled by a process pool
+        (see _shard_worker); otherwise rows are sent from the event loop.
         """
-        with self.lock:
-            if not self.peers:
-                print("[Manager] No peers registered. Cannot distribute events.")
-                return
-            sorted_peer_ids = sorted(self.peers.keys())
-            num_peers = len(sorted_peer_ids)
+        m = self._membership
+        if not m.sorted_ids:
+            print("[Manager] No peers registered. Cannot distribute events.")
+            return
+        cached = self._ring
+        if cached is None or cached[0] is not m:
+            cached = (m, _build_ring(m.sorted_ids))
+            self._ring = cached
+        tokens, owners = cached[1]
+
+        if not os.path.exists(self.csv_path):
+            print(f"[Manager] CSV file {self.csv_path} not found. Nothing to distribute.")
+            return
 
         print("[Manager] Distributing events to peers...")
-        for event in self.events:
-            # Use 'EVENT_ID' from the CSV if present; otherwise fall back to hashing the entire row.
-            key = event.get("EVENT_ID")
-            if key is None:
-                key = hash(str(event))
-            # Convert to string if needed
-            key_str = str(key)
-
-            # Assign to a peer based on the hash of the event_id
-            assigned_index = hash(key_str) % num_peers
-            assigned_peer_id = sorted_peer_ids[assigned_index]
-            assigned_peer = self.peers[assigned_peer_id]
-            msg = {
-                "command": "store",
-                "event_id": key_str,
-                "event_data": event
-            }
-            try:
-                self.sock.sendto(json.dumps(msg).encode(), assigned_peer)
-            except Exception as e:
-                print(f"[Manager] Error sending store to peer {assigned_peer_id}:", e)
+        self.acks_received = 0
+        self.acks_expected = None
+        workers = min(len(m.sorted_ids), DISTRIBUTE_WORKERS)
+        self._distributing += 1
+        try:
+            if workers > 1:
+                count, sent = await self._distribute_sharded(m, workers, tokens, owners)
+            else:
+                count, sent = await self._distribute_inline(m, tokens, owners)
+        finally:
+            self._distributing -= 1
+            if not self._distributing:
+                retired, self._retired_socks = self._retired_socks, []
+                for peer_sock in retired:
+                    peer_sock.close()
+        if sent == count:
+            print(f"[Manager] Distribution complete. Sent {sent} events across {len(m.sorted_ids)} peers.")
+        else:
+            print(f"[Manager] Distribution complete. Sent {sent} of {count} events across "
+                  f"{len(m.sorted_ids)} peers; {count - sent} could not be sent.")
+        self.acks_expected = sent
+        if sent and self.acks_received == sent:
+            print(f"[Manager] All {sent} events acknowledged.")
+
+    async def _distribute_inline(self, m, tokens, owners):
+        """
+        Parse, place and send every row from the event loop. Yields every
+        DISTRIBUTE_BATCH events so store_acks keep being received. Stores are
+        queued per peer and sent STORE_BATCH at a time on that peer's
+        connected socket (see _flush_stores). Returns (events read, events
+        actually sent).
+        """
+        peer_ids, peer_socks = m.sorted_ids, m.peer_socks
+        pending = [[] for _ in peer_ids]  # Queued store packets, parallel to peer_ids
+        unreachable = set()  # Peer IDs whose remaining stores are skipped
+        count = 0
+        sent = 0
+        with open(self.csv_path, newline='', encoding='utf-8', buffering=1 << 20) as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, [])
+            packets = _store_packets(reader, header, tokens, owners)
+            for count, (assigned_index, packet) in enumerate(packets, 1):
+                queue = pending[assigned_index]
+                queue.append(packet)
+                if len(queue) >= STORE_BATCH:
+                    sent += await self._flush_stores(
+                        peer_ids[assigned_index], peer_socks[assigned_index], queue, unreachable)
+                if count % DISTRIBUTE_BATCH == 0:
+                    await asyncio.sleep(0)
+
+        for peer_id, peer_sock, queue in zip(peer_ids, peer_socks, pending):
+            if queue:
+                sent += await self._flush_stores(peer_id, peer_sock, queue, unreachable)
+        return count, sent
 
-        print("[Manager] Distribution complete.")
+    async def _distribute_sharded(self, m, workers, tokens, owners):
+        """
+        Split the CSV into `workers` line-aligned byte ranges and distribute
+        each from its own process, in parallel. The event loop stays free to
+        receive the store_acks meanwhile. Returns (events read, events
+        actually sent).
+        """
+        header = _read_header(self.csv_path)
+        shards = _shard_bounds(self.csv_path, workers)
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(shards) or 1) as pool:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(
+                    pool, _shard_worker, self.csv_path, start, end, header,
+                    tokens, owners, m.sorted_ids, m.targets)
+                for start, end in shards
+            ))
+        unreachable = {}
+        for _, _, shard_unreachable in results:
+            unreachable.update(shard_unreachable)
+        for peer_id in sorted(unreachable):
+            _report_unreachable(peer_id, unreachable[peer_id])
+        return sum(count for count, _, _ in results), sum(sent for _, sent, _ in results)
 
-    def console_thread(self):
+    async def _flush_stores(self, peer_id, peer_sock, packets, unreachable):
         """
-        A separate thread to accept console commands:
+        Send and clear a peer's queued store packets. Whatever does not fit in
+        the socket's send buffer waits until it is writable rather than being dropped.
+        Packets for a peer in `unreachable` are dropped (see _UNREACHABLE_ERRNOS).
+        Returns how many packets actually went out.
+        """
+        if peer_id in unreachable:
+            packets.clear()
+            return 0
+        loop = asyncio.get_running_loop()
+        sent = 0
+        try:
+            sent = _send_batch(peer_sock, packets)
+            for packet in packets[sent:]:
+                await loop.sock_sendall(peer_sock, packet)
+                sent += 1
+        except OSError as e:
+            if e.errno in _UNREACHABLE_ERRNOS:
+                unreachable.add(peer_id)
+                _report_unreachable(peer_id, e.strerror)
+            else:
+                print(f"[Manager] Error sending stores to peer {peer_id}:", e)
+        packets.clear()
+        return sent
+
+    async def console(self):
+        """
+        An event-loop task to accept console commands:
           - setup: run update_ring
           - distribute: distribute events to peers
           - teardown: shut down all peers
         """
+        stdin = StdinLines(asyncio.get_running_loop())
+        prompt = "Manager command (setup, distribute, teardown): "
+        try:
+            await self._console_loop(stdin, prompt)
+        finally:
+            stdin.close()
+
+    async def _console_loop(self, stdin, prompt):
+        """Read and run console commands until stdin closes or the manager stops."""
         while self.running:
             try:
-                cmd = input("Manager command (setup, distribute, teardown): ").strip()
+                cmd = (await stdin.readline(prompt)).strip()
                 if cmd == "setup":
                     self.update_ring()
                 elif cmd == "distribute":
-                    self.distribute_events()
+                    await self.distribute_events()
                 elif cmd == "teardown":
                     self.teardown()
                 else:
                     print("Unknown command. Available: setup, distribute, teardown")
+            except EOFError:
+                break  # stdin closed; keep serving peers until teardown
             except Exception as e:
-                print("Error in console thread:", e)
+                print("Error in console:", e)
 
     def teardown(self):
-        """Send a 'teardown' command to all peers, then stop running."""
-        with self.lock:
-            for peer_id, (address, port) in self.peers.items():
-                msg = {"command": "teardown"}
-                try:
-                    self.sock.sendto(json.dumps(msg).encode(), (address, port))
-                except Exception as e:
-                    print(f"[Manager] Error sending teardown to peer {peer_id}:", e)
+        """Send a 'teardown' command to all peers, close their store sockets, then stop running."""
+        packet = _TEARDOWN_PACKET
+        m, self._membership = self._membership, _NO_PEERS
+        for peer_id, (address, port) in m.peers.items():
+            try:
+                self.transport.sendto(packet, (address, port))
+            except Exception as e:
+                print(f"[Manager] Error sending teardown to peer {peer_id}:", e)
+        for peer_sock in m.peer_socks:
+            self._retire_socket(peer_sock)
         self.running = False
+        if self._stopped is not None and not self._stopped.done():
+            self._stopped.set_result(None)
         print("[Manager] Shutting down.")
 
 if __name__ == "__main__":
     manager = Manager()
-    # Load CSV data (if available)
+    # Check the CSV data (if available); rows are streamed at distribute time
     manager.load_csv()
 
     try:
         manager.run()
     except KeyboardInterrupt:
+        # Peers were already sent teardown before the event loop closed
         print("Keyboard interrupt received, shutting down.")
-        manager.teardown()
         sys.exit(0)
@@ -9,14 +9,27 @@ This script implements a peer (DHT node) that:
   - Responds with 'found_event' if it has the data
   - Can 'leave' (notify manager of departure)
   - Shuts down gracefully on 'teardown'
+
+All networking and console handling runs on a single asyncio event loop.
 """
 
+import asyncio
 import socket
-import threading
-import json
 import sys
 
+from dht_common import DrainingProtocol, StdinLines, dumps
+
 MANAGER_ADDRESS = ('127.0.0.1', 5000)
+RECV_BUFFER_BYTES = 4 << 20  # Kernel receive buffer, sized to absorb store bursts
+VERBOSE = False  # Print a line for every stored event
+STORE_REPORT_EVERY = 10000  # When not verbose, print a running count this often
+
+class PeerProtocol(DrainingProtocol):
+    """asyncio endpoint for a peer's UDP socket; see DrainingProtocol."""
+    error_label = "[Peer] Error in listener:"
+
+    def __init__(self, peer):
+        super().__init__(peer.sock, peer.handle_message)
 
 class Peer:
     """
@@ -26,42 +39,31 @@ class Peer:
       - Handles queries across the ring
       - Maintains a pointer to the next peer (IP, port)
     """
-    def __init__(self, p_port):
+    def __init__(self, p_port, verbose=VERBOSE):
         self.p_port = p_port              # UDP port for this peer
+        self.verbose = verbose
+        self.stores_received = 0          # 'store' messages handled so far
         self.peer_id = None               # Assigned by the manager
         self.manager_address = MANAGER_ADDRESS
         self.running = True
         self.data_store = {}              # event_id -> event_data
         self.next_peer = None             # (ip, port) for next peer in ring
-        self.lock = threading.Lock()
+        self.transport = None             # Set once start() attaches the socket to the event loop
+        self._registered = None           # Future resolved by the manager's 'set_id'
+        self._stopped = None              # Future resolved when this peer shuts down
 
         # Create and bind the UDP socket
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
         self.sock.bind(('127.0.0.1', self.p_port))
         print(f"[Peer] Started on port {self.p_port}")
 
-    def register_with_manager(self):
+    async def register_with_manager(self):
         """Send a 'register' command to the manager and wait for the 'set_id' response."""
+        self._registered = asyncio.get_running_loop().create_future()
         msg = {"command": "register", "peer_port": self.p_port}
-        self.sock.sendto(json.dumps(msg).encode(), self.manager_address)
-
-        data, addr = self.sock.recvfrom(4096)
-        response = json.loads(data.decode())
-        if response.get("command") == "set_id":
-            self.peer_id = response.get("peer_id")
-            print(f"[Peer] Registered with manager. Assigned ID: {self.peer_id}")
-        else:
-            print("[Peer] Unexpected response from manager:", response)
-
-    def listen(self):
-        """Background thread that listens for incoming UDP messages."""
-        while self.running:
-            try:
-                data, addr = self.sock.recvfrom(4096)
-                message = json.loads(data.decode())
-                self.handle_message(message, addr)
-            except Exception as e:
-                print("[Peer] Error in listening thread:", e)
+        self.transport.sendto(dumps(msg), self.manager_address)
+        await self._registered
 
     def handle_message(self, message, addr):
         """
@@ -85,8 +87,7 @@ class Peer:
         elif command == "teardown":
             self.handle_teardown()
         elif command == "set_id":
-            # Normally handled right after registration; ignoring duplicates
-            pass
+            self.handle_set_id(message)
         else:
             print(f"[Peer {self.peer_id}] Unknown command: {command}")
 
@@ -102,7 +103,7 @@ class Peer:
             "peer_id": self.peer_id,
             "event_id": event_id
         }
-        self.sock.sendto(json.dumps(ack).encode(), self.manager_address)
+        self.transport.sendto(dumps(ack), self.manager_address)
 
     def handle_find_event(self, message, addr):
         """Look up event locally; if not found, forward to next peer."""
@@ -114,12 +115,12 @@ class Peer:
                 "event_id": event_id,
                 "event_data": self.data_store[event_id]
             }
-            self.sock.sendto(json.dumps(response).encode(), addr)
+            self.transport.sendto(dumps(response), addr)
         else:
             # Not found, forward if next peer is known
             if self.next_peer:
                 print(f"[Peer {self.peer_id}] Forwarding query for event {event_id} to {self.next_peer}")
-                self.sock.sendto(json.dumps(message).encode(), self.next_peer)
+                self.transport.sendto(dumps(message), self.next_peer)
             else:
                 print(f"[Peer {self.peer_id}] Event {event_id} not found and no next peer set.")
 
@@ -129,6 +130,14 @@ class Peer:
         event_data = message.get("event_data")
         print(f"[Peer {self.peer_id}] Found event {event_id}: {event_data}")
 
+    def handle_set_id(self, message):
+        """Take the ID assigned at registration; later duplicates are ignored."""
+        if self._registered is None or self._registered.done():
+            return
+        self.peer_id = message.get("peer_id")
+        print(f"[Peer] Registered with manager. Assigned ID: {self.peer_id}")
+        self._registered.set_result(self.peer_id)
+
     def handle_set_next_peer(self, message):
         """Update the next peer in the ring."""
         self.next_peer = tuple(message.get("next_peer"))
@@ -136,14 +145,17 @@ class Peer:
 
     def handle_teardown(self):
         """Shut down this peer."""
-        self.running = False
+        self.stop()
         print(f"[Peer {self.peer_id}] Received teardown command. Shutting down.")
 
     def store_event(self, event_id, event_data):
-        """Thread-safe local storage of an event."""
-        with self.lock:
-            self.data_store[event_id] = event_data
-        print(f"[Peer {self.peer_id}] Stored event {event_id}")
+        """Local storage of an event (only ever touched from the event loop)."""
+        self.data_store[event_id] = event_data
+        self.stores_received += 1
+        if self.verbose:
+            print(f"[Peer {self.peer_id}] Stored event {event_id}")
+        elif self.stores_received % STORE_REPORT_EVERY == 0:
+            print(f"[Peer {self.peer_id}] Stored {self.stores_received} events")
 
     def query_event(self, event_id):
         """
@@ -153,7 +165,7 @@ class Peer:
         msg = {"command": "find_event", "event_id": event_id}
         if self.next_peer:
             print(f"[Peer {self.peer_id}] Sending query for event {event_id} to next peer {self.next_peer}")
-            self.sock.sendto(json.dumps(msg).encode(), self.next_peer)
+            self.transport.sendto(dumps(msg), self.next_peer)
         else:
             print("[Peer] Next peer not set. Checking locally.")
             self.handle_message(msg, None)
@@ -162,24 +174,54 @@ class Peer:
         """Notify the manager that this peer is leaving the ring."""
         if self.peer_id is not None:
             msg = {"command": "leave", "peer_id": self.peer_id}
-            self.sock.sendto(json.dumps(msg).encode(), self.manager_address)
+            self.transport.sendto(dumps(msg), self.manager_address)
+        self.stop()
+
+    def stop(self):
+        """Stop the console and let start() return."""
         self.running = False
+        if self._stopped is not None and not self._stopped.done():
+            self._stopped.set_result(None)
 
     def start(self):
         """
         - Register with the manager
-        - Start a background listener thread
+        - Serve incoming UDP messages on an asyncio event loop
         - Provide a simple console interface for user commands
         """
-        self.register_with_manager()
-        listener_thread = threading.Thread(target=self.listen, daemon=True)
-        listener_thread.start()
+        asyncio.run(self._serve())
+        print(f"[Peer {self.peer_id}] Exiting.")
 
+    async def _serve(self):
+        """Attach the UDP socket to the event loop, register, and run the console until stopped."""
+        loop = asyncio.get_running_loop()
+        self._stopped = loop.create_future()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: PeerProtocol(self), sock=self.sock)
+        try:
+            await self.register_with_manager()
+            console = asyncio.create_task(self.console())
+            await self._stopped
+            console.cancel()
+        finally:
+            self.transport.close()
+
+    async def console(self):
+        """An event-loop task that reads and runs user commands."""
+        stdin = StdinLines(asyncio.get_running_loop())
+        prompt = "Enter command (query <event_id> / leave / exit): "
+        try:
+            await self._console_loop(stdin, prompt)
+        finally:
+            stdin.close()
+
+    async def _console_loop(self, stdin, prompt):
+        """Read and run user commands until stdin closes or the peer stops."""
         while self.running:
             try:
-                user_input = input("Enter command (query <event_id> / leave / exit): ").strip()
+                user_input = (await stdin.readline(prompt)).strip()
                 if user_input == "exit":
-                    self.running = False
+                    self.stop()
                     break
                 elif user_input.startswith("query"):
                     parts = user_input.split()
@@ -192,11 +234,11 @@ class Peer:
                     self.send_leave()
                 else:
                     print("Unknown command.")
+            except EOFError:
+                break  # stdin closed; keep serving until teardown
             except Exception as e:
                 print("[Peer] Error in main loop:", e)
 
-        print(f"[Peer {self.peer_id}] Exiting.")
-
 if __name__ == "__main__":
     if len(sys.argv) != 2:
         print("Usage: python peer.py <peer_port>")